@@ -4,9 +4,24 @@ Calibre HTTP API Service
 Provides a simple HTTP API for ebook conversion using Calibre
 """
 
+import contextlib
+import functools
+import hashlib
+import mmap
 import os
+import queue
+import select
+import shutil
+import signal
+import stat
 import subprocess
 import json
+import threading
+import time
+import uuid
+from collections import deque
+from itertools import chain
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from flask import Flask, request, jsonify
 from flask_cors import CORS
@@ -16,6 +31,256 @@ CORS(app)  # Enable CORS for Next.js dev server
 
 # Base path for books
 BOOKS_BASE = os.environ.get('CALIBRE_LIBRARY_PATH', '/books')
+BOOKS_ROOT = Path(BOOKS_BASE).resolve()
+
+# Conversions run in background threads, each one waiting on its own
+# ebook-convert process, so N workers keep N cores busy
+CONVERT_WORKERS = int(os.environ.get('CALIBRE_CONVERT_WORKERS', os.cpu_count() or 1))
+
+# Converted files, named by a hash of source content + options, reused when
+# the same book is converted again with the same options. Disabled unless
+# CALIBRE_CACHE_PATH is set. Entries are copies, so the cache uses its own
+# disk space; the least recently used entries are pruned whenever it grows
+# past CACHE_MAX_BYTES.
+CACHE_DIR = os.environ.get('CALIBRE_CACHE_PATH')
+CACHE_MAX_BYTES = int(os.environ.get('CALIBRE_CACHE_MAX_MB', '1024')) * 1024 * 1024
+
+# Non-PDF conversions run in long-lived calibre-debug processes, so Calibre's
+# interpreter startup is paid once per worker instead of once per book
+PERSISTENT_WORKERS = os.environ.get('CALIBRE_PERSISTENT_WORKERS', '1') != '0'
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'calibre_worker.py')
+
+# Recycle a persistent worker after this many jobs to bound leaked state
+WORKER_MAX_JOBS = 50
+
+# Line calibre_worker.py writes to stderr after each job's output
+WORKER_JOB_END = '--- calibre_worker job end ---'
+
+# Display of the shared Xvfb server used for PDF output
+XVFB_DISPLAY = os.environ.get('CALIBRE_XVFB_DISPLAY', ':99')
+XVFB_SOCKET = f"/tmp/.X11-unix/X{XVFB_DISPLAY.lstrip(':')}"
+XVFB_LOCK = f"/tmp/.X{XVFB_DISPLAY.lstrip(':')}-lock"
+
+# Finished jobs are kept this long so clients can still poll their result
+JOB_TTL = 60 * 60
+
+_executor = ThreadPoolExecutor(max_workers=CONVERT_WORKERS, thread_name_prefix='convert')
+_jobs = {}  # job_id -> {'future': Future, 'created': timestamp}
+_inflight = {}  # (source, target, option flags) -> job_id of the unfinished conversion
+_jobs_lock = threading.Lock()
+_idle_workers = queue.SimpleQueue()  # CalibreWorker instances waiting for a job
+_xvfb_proc = None  # Xvfb started by start_display()
+_xvfb_owner = None  # pid of the process that started it (gunicorn forks workers)
+
+
+class ConversionError(Exception):
+    """Conversion failure carrying the JSON payload reported to the client"""
+
+    def __init__(self, payload):
+        super().__init__(payload.get('error'))
+        self.payload = payload
+
+def run_command(cmd, timeout=None, env=None, tail_lines=256, stderr=subprocess.STDOUT):
+    """
+    Run a command, streaming its stdout (merged with stderr by default) and
+    keeping only the last tail_lines lines, so chatty conversions don't
+    buffer their whole log. Pass stderr=subprocess.DEVNULL when stdout is
+    data to be parsed.
+    The command gets its own process group so a timeout kills everything it
+    spawned (xvfb-run, Xvfb, ebook-convert), not just the direct child.
+    Returns a CompletedProcess whose stdout holds the kept tail.
+    """
+    proc = subprocess.Popen(
+        cmd,
+        stdout=subprocess.PIPE,
+        stderr=stderr,
+        text=True,
+        errors='replace',
+        env=env,
+        start_new_session=True
+    )
+
+    timed_out = threading.Event()
+
+    def kill():
+        # The command may have finished just as the timer fired
+        if proc.poll() is not None:
+            return
+        timed_out.set()
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+    timer = threading.Timer(timeout, kill) if timeout else None
+    if timer:
+        timer.start()
+    try:
+        with proc.stdout:
+            tail = deque(proc.stdout, maxlen=tail_lines)
+        proc.wait()
+    finally:
+        if timer:
+            timer.cancel()
+
+    # Only a process our timer actually killed counts as timed out
+    if timed_out.is_set() and proc.returncode == -signal.SIGKILL:
+        raise subprocess.TimeoutExpired(cmd, timeout)
+    return subprocess.CompletedProcess(cmd, proc.returncode, ''.join(tail))
+
+class CalibreWorker:
+    """
+    A calibre-debug process running calibre_worker.py, which converts one
+    JSON job per line on stdin and replies with one JSON line on stdout.
+    Calibre's log goes to stderr and, as in run_command, only its last
+    tail_lines lines of the current job are kept.
+    """
+
+    def __init__(self, tail_lines=256):
+        self.jobs = 0
+        self.closed = False
+        self.proc = subprocess.Popen(
+            ['calibre-debug', '-e', WORKER_SCRIPT],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            errors='replace',
+            start_new_session=True
+        )
+        self.output = deque(maxlen=tail_lines)
+        self.job_end = threading.Event()
+        threading.Thread(target=self._drain_stderr, daemon=True).start()
+
+    def _drain_stderr(self):
+        """Collect the worker's log until it exits (runs on its own thread)"""
+        with self.proc.stderr:
+            for line in self.proc.stderr:
+                # The worker writes the marker on a line of its own
+                if line.strip() == WORKER_JOB_END:
+                    self.job_end.set()
+                else:
+                    self.output.append(line)
+        self.job_end.set()
+
+    def convert(self, full_source, full_target, opt_args, timeout):
+        """Run one conversion; returns a CompletedProcess like run_command"""
+        cmd = ['ebook-convert', str(full_source), str(full_target), *opt_args]
+        job = {'src': str(full_source), 'dst': str(full_target), 'opts': opt_args}
+
+        timed_out = threading.Event()
+        replied = threading.Event()
+
+        def kill():
+            # The reply may have arrived just as the timer fired
+            if replied.is_set():
+                return
+            timed_out.set()
+            self.close()
+
+        self.output.clear()
+        self.job_end.clear()
+
+        timer = threading.Timer(timeout, kill)
+        timer.start()
+        try:
+            self.proc.stdin.write(json.dumps(job) + '\n')
+            self.proc.stdin.flush()
+            line = self.proc.stdout.readline()
+        except (BrokenPipeError, ValueError):
+            line = ''
+        finally:
+            replied.set()
+            timer.cancel()
+        self.jobs += 1
+
+        # A reply that was read before the kill still counts; the killed
+        # worker is discarded by convert_in_worker
+        if timed_out.is_set() and not line:
+            raise subprocess.TimeoutExpired(cmd, timeout)
+
+        # The job's log is complete once the end marker (or EOF) is read
+        self.job_end.wait(5)
+        tail = ''.join(self.output)
+
+        if not line:
+            self.close()
+            return subprocess.CompletedProcess(
+                cmd, 1, tail + 'Calibre worker exited unexpectedly\n'
+            )
+
+        reply = json.loads(line)
+        if reply.get('ok'):
+            return subprocess.CompletedProcess(cmd, 0, tail)
+        return subprocess.CompletedProcess(cmd, 1, tail + reply.get('error', ''))
+
+    def alive(self):
+        return not self.closed and self.proc.poll() is None
+
+    def close(self):
+        """Kill the worker and anything it spawned"""
+        self.closed = True
+        try:
+            os.killpg(self.proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+def convert_in_worker(full_source, full_target, opt_args, timeout):
+    """
+    Convert in an idle persistent worker, starting one if none is free.
+    Returns None if calibre-debug can't be started.
+    """
+    worker = None
+    while worker is None:
+        try:
+            worker = _idle_workers.get_nowait()
+        except queue.Empty:
+            break
+        # Workers can die while idle (OOM, crash); replace those
+        if not worker.alive():
+            worker.close()
+            worker.proc.wait()
+            worker = None
+
+    if worker is None:
+        try:
+            worker = CalibreWorker()
+        except OSError as e:
+            app.logger.warning("Could not start Calibre worker: %s", e)
+            return None
+
+    try:
+        return worker.convert(full_source, full_target, opt_args, timeout)
+    finally:
+        if worker.alive() and worker.jobs < WORKER_MAX_JOBS:
+            _idle_workers.put(worker)
+        else:
+            worker.close()
+            worker.proc.wait()
+
+def _probe(cmd, timeout=None):
+    """Run a Calibre query whose stdout is data; stderr warnings are dropped"""
+    result = run_command(cmd, timeout=timeout, stderr=subprocess.DEVNULL)
+    if result.returncode != 0:
+        raise subprocess.CalledProcessError(result.returncode, cmd)
+    return result
+
+def _probe_formats():
+    """Ask ebook-convert for its supported input and output formats"""
+    try:
+        # Bounded, since this runs at import and a hung probe would stop boot
+        input_result = _probe(['ebook-convert', '--input-fmts'], timeout=30)
+        output_result = _probe(['ebook-convert', '--output-fmts'], timeout=30)
+        return {
+            'input_formats': input_result.stdout.strip().split(),
+            'output_formats': output_result.stdout.strip().split()
+        }
+    except Exception as e:
+        print(f"Could not read supported formats: {e}")
+        return {'input_formats': [], 'output_formats': []}
+
+# Supported formats never change for an install, so probe them once at import
+_FORMATS = _probe_formats()
 
 @app.route('/health', methods=['GET'])
 def health():
@@ -35,154 +300,429 @@ def version():
 @app.route('/convert', methods=['POST'])
 def convert():
     """
-    Convert ebook format
+    Queue an ebook format conversion
     Request body: {
         "source_path": "books/book-name/book.epub",
         "target_path": "books/book-name/book.pdf",
         "options": {}  # Optional conversion options
     }
+    Returns: { "job_id": "..." } - poll /convert/status/<job_id> for the result
     """
     try:
         data = request.json
-        print(f"Received conversion request: {data}")
+        app.logger.debug("Received conversion request: %s", data)
         source_path = data.get('source_path')
         target_path = data.get('target_path')
         options = data.get('options', {})
-        print(f"Parsed - source: {source_path}, target: {target_path}")
 
         if not source_path or not target_path:
             return jsonify({
                 'error': 'source_path and target_path are required'
             }), 400
 
-        # Construct full paths
-        full_source = os.path.join(BOOKS_BASE, source_path)
-        full_target = os.path.join(BOOKS_BASE, target_path)
-
-        print(f"Looking for source file: {full_source}")
-        print(f"Source path exists: {os.path.exists(full_source)}")
-
-        # List directory contents for debugging
-        source_dir = os.path.dirname(full_source)
-        if os.path.exists(source_dir):
-            print(f"Contents of {source_dir}:")
-            for f in os.listdir(source_dir):
-                print(f"  - {f}")
-        else:
-            print(f"Source directory does not exist: {source_dir}")
+        # Resolve full paths once and keep them inside the library, so
+        # "../" or absolute paths can't reach other files (or /dev/zero)
+        full_source = (BOOKS_ROOT / source_path).resolve()
+        full_target = (BOOKS_ROOT / target_path).resolve()
+        if not (full_source.is_relative_to(BOOKS_ROOT) and full_target.is_relative_to(BOOKS_ROOT)):
+            return jsonify({
+                'error': 'source_path and target_path must be inside the library'
+            }), 400
+        if full_source == full_target:
+            return jsonify({
+                'error': 'source_path and target_path must be different files'
+            }), 400
 
-        # Verify source exists
-        if not os.path.exists(full_source):
+        # Verify source exists and is a regular file
+        try:
+            src_stat = os.stat(full_source)
+        except FileNotFoundError:
             return jsonify({
                 'error': f'Source file not found: {source_path}'
             }), 404
+        if not stat.S_ISREG(src_stat.st_mode):
+            return jsonify({
+                'error': f'Source is not a file: {source_path}'
+            }), 400
 
-        # Ensure target directory exists
-        target_dir = os.path.dirname(full_target)
-        os.makedirs(target_dir, exist_ok=True)
+        # Serialized once; the flags also key deduplication and the cache
+        opt_args = option_args(options)
 
-        # Build ebook-convert command
-        cmd = ['ebook-convert', full_source, full_target]
+        # Identical requests (e.g. client retries) share one conversion
+        key = (full_source, full_target, opt_args)
+        job_id = submit_job(
+            key, run_convert, source_path, target_path, full_source, full_target, opt_args
+        )
+        app.logger.debug("Conversion job %s for %s", job_id, source_path)
 
-        # Add options
-        for key, value in options.items():
-            cmd.append(f'--{key}')
-            if value is not True:
-                cmd.append(str(value))
+        return jsonify({
+            'job_id': job_id,
+            'status': 'pending'
+        }), 202
 
-        # Run conversion with xvfb-run for PDF (Qt WebEngine needs a display)
-        target_ext = os.path.splitext(full_target)[1].lower()
-        env = os.environ.copy()
-        if target_ext == '.pdf':
-            cmd = ['xvfb-run', '-a', '--server-args=-screen 0 1024x768x24'] + cmd
-            # Disable Chromium sandbox (required when running as root in container)
-            env['QTWEBENGINE_CHROMIUM_FLAGS'] = '--no-sandbox --disable-gpu'
+    except Exception as e:
+        return jsonify({
+            'error': str(e)
+        }), 500
 
-        print(f"Running: {' '.join(cmd)}")
-        result = subprocess.run(
-            cmd,
-            capture_output=True,
-            text=True,
-            timeout=300,  # 5 minute timeout
-            env=env
-        )
+@app.route('/convert/status/<job_id>', methods=['GET'])
+def convert_status(job_id):
+    """Get the state of a queued conversion and, once finished, its result"""
+    with _jobs_lock:
+        job = _jobs.get(job_id)
 
-        if result.returncode != 0:
-            print(f"Conversion failed with return code {result.returncode}")
-            print(f"STDOUT: {result.stdout}")
-            print(f"STDERR: {result.stderr}")
-            return jsonify({
-                'error': 'Conversion failed',
-                'details': result.stderr,
-                'stdout': result.stdout
-            }), 500
+    if job is None:
+        return jsonify({
+            'error': f'Job not found: {job_id}'
+        }), 404
 
-        # Verify output exists
-        if not os.path.exists(full_target):
-            return jsonify({
-                'error': 'Conversion completed but output file not found'
-            }), 500
+    future = job['future']
+    if not future.done():
+        return jsonify({
+            'job_id': job_id,
+            'status': 'processing' if future.running() else 'pending'
+        })
 
-        # Get output file size
-        file_size = os.path.getsize(full_target)
+    try:
+        result = future.result()
+    except ConversionError as e:
+        return jsonify({'job_id': job_id, 'status': 'failed', **e.payload})
+    except Exception as e:
+        return jsonify({'job_id': job_id, 'status': 'failed', 'error': str(e)})
 
-        return jsonify({
+    return jsonify({'job_id': job_id, 'status': 'completed', **result})
+
+def submit_job(key, fn, *args):
+    """
+    Run fn in the conversion pool and return the id to poll it by.
+    While a job with the same key is unfinished, its id is returned instead
+    of starting a duplicate.
+    """
+    now = time.time()
+    with _jobs_lock:
+        job_id = _inflight.get(key)
+        if job_id is not None:
+            return job_id
+
+        # Drop finished jobs nobody has asked about for a while
+        for stale_id in [
+            jid for jid, job in _jobs.items()
+            if job['future'].done() and now - job['created'] > JOB_TTL
+        ]:
+            del _jobs[stale_id]
+
+        job_id = str(uuid.uuid4())
+        future = _executor.submit(fn, *args)
+        _jobs[job_id] = {
+            'future': future,
+            'created': now
+        }
+        _inflight[key] = job_id
+
+    # Registered outside the lock: runs immediately if the job already finished
+    future.add_done_callback(lambda _: _release_inflight(key, job_id))
+    return job_id
+
+def _release_inflight(key, job_id):
+    """Let new requests for key start a fresh job once job_id is done"""
+    with _jobs_lock:
+        if _inflight.get(key) == job_id:
+            del _inflight[key]
+
+def run_convert(source_path, target_path, full_source, full_target, opt_args):
+    """Run ebook-convert for a queued job (executes on a pool thread)"""
+    try:
+        # Ensure target directory exists
+        full_target.parent.mkdir(parents=True, exist_ok=True)
+
+        target_ext = full_target.suffix.lower()
+
+        # Reuse a previous conversion of identical content with the same options
+        cache_path = _cache_path(full_source, opt_args, target_ext) if CACHE_DIR else None
+        try:
+            cache_stat = os.stat(cache_path) if cache_path else None
+        except FileNotFoundError:
+            cache_stat = None
+        if cache_stat is not None:
+            app.logger.debug("Using cached conversion: %s", cache_path)
+            with _staging_path(full_target) as staged:
+                shutil.copyfile(cache_path, staged)
+                os.replace(staged, full_target)
+            # Mark as recently used so pruning keeps it
+            try:
+                os.utime(cache_path)
+            except OSError:
+                pass
+            return {
+                'success': True,
+                'source_path': source_path,
+                'target_path': target_path,
+                'file_size': cache_stat.st_size,
+                'cached': True,
+                'message': 'Conversion completed successfully (cached)'
+            }
+
+        # Convert into a staging path and move the result over the target
+        # only on success, so a failed run leaves an existing target untouched
+        with _staging_path(full_target) as staged:
+            file_size = _convert_to(full_source, staged, target_ext, opt_args)
+            os.replace(staged, full_target)
+
+        # Keep the result for later requests; a cache failure isn't fatal
+        if cache_path:
+            try:
+                os.makedirs(CACHE_DIR, exist_ok=True)
+                _copy_atomic(full_target, cache_path)
+                os.utime(cache_path)
+                _prune_cache()
+            except OSError as e:
+                app.logger.warning("Could not cache conversion: %s", e)
+
+        return {
             'success': True,
             'source_path': source_path,
             'target_path': target_path,
             'file_size': file_size,
             'message': 'Conversion completed successfully'
-        })
+        }
 
     except subprocess.TimeoutExpired:
-        return jsonify({
+        raise ConversionError({
             'error': 'Conversion timed out (max 5 minutes)'
-        }), 504
-    except Exception as e:
-        return jsonify({
-            'error': str(e)
-        }), 500
+        })
+
+def _convert_to(full_source, full_target, target_ext, opt_args):
+    """Run the conversion itself and return the output size"""
+    # PDF output goes through Qt WebEngine, which needs a fresh process
+    # with its own environment, so only other formats use the worker pool
+    result = None
+    if PERSISTENT_WORKERS and target_ext != '.pdf':
+        app.logger.debug("Converting in Calibre worker: %s", full_source)
+        result = convert_in_worker(full_source, full_target, opt_args, timeout=300)
+
+    if result is None:
+        # Build ebook-convert command
+        cmd = ['ebook-convert', str(full_source), str(full_target), *opt_args]
+
+        # PDF output needs a display (Qt WebEngine); use the shared Xvfb
+        # started at boot, or xvfb-run if it is missing or has died
+        env = os.environ.copy()
+        if target_ext == '.pdf':
+            if not shared_display_ready():
+                cmd = ['xvfb-run', '-a', '--server-args=-screen 0 1024x768x24'] + cmd
+            # Disable Chromium sandbox (required when running as root in container)
+            env['QTWEBENGINE_CHROMIUM_FLAGS'] = '--no-sandbox --disable-gpu'
+
+        app.logger.debug("Running: %s", ' '.join(cmd))
+        result = run_command(cmd, timeout=300, env=env)  # 5 minute timeout
+
+    if result.returncode != 0:
+        app.logger.warning(
+            "Conversion failed with return code %s:\n%s", result.returncode, result.stdout
+        )
+        raise ConversionError({
+            'error': 'Conversion failed',
+            'details': result.stdout
+        })
+
+    # Verify output exists and get its size
+    try:
+        out_stat = os.stat(full_target)
+    except FileNotFoundError:
+        raise ConversionError({
+            'error': 'Conversion completed but output file not found'
+        })
+    return out_stat.st_size
+
+def option_args(options):
+    """
+    Turn conversion options into ebook-convert flags, sorted by name so
+    equivalent requests produce the same list
+    """
+    return tuple(chain.from_iterable(
+        (f'--{key}',) if value is True else (f'--{key}', str(value))
+        for key, value in sorted(options.items())
+    ))
+
+def _cache_path(full_source, opt_args, target_ext):
+    """
+    Cache location for converting full_source with opt_args to target_ext.
+    blake2b is used since this only has to detect changed content, and it
+    is faster than SHA-256.
+    """
+    digest = hashlib.blake2b()
+    with open(full_source, 'rb') as f:
+        # mmap rejects empty files
+        if os.fstat(f.fileno()).st_size:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                digest.update(data)
+    digest.update(json.dumps(opt_args).encode())
+    return os.path.join(CACHE_DIR, digest.hexdigest() + target_ext)
+
+@contextlib.contextmanager
+def _staging_path(full_target):
+    """
+    Temporary path with full_target's name (the extension selects the output
+    format) inside <target dir>/.converting/<id>/, a folder the library
+    scanner ignores, on the same filesystem so os.replace can move it
+    """
+    staging_dir = full_target.parent / '.converting' / uuid.uuid4().hex
+    staging_dir.mkdir(parents=True)
+    try:
+        yield staging_dir / full_target.name
+    finally:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        # Only succeeds once no other conversion is staging here
+        try:
+            staging_dir.parent.rmdir()
+        except OSError:
+            pass
+
+def _prune_cache():
+    """Evict least recently used cache entries until under CACHE_MAX_BYTES"""
+    entries = []
+    total = 0
+    with os.scandir(CACHE_DIR) as it:
+        for entry in it:
+            # Skip in-progress copies made by _copy_atomic
+            if entry.name.endswith('.tmp') or not entry.is_file():
+                continue
+            try:
+                entry_stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((entry_stat.st_mtime, entry_stat.st_size, entry.path))
+            total += entry_stat.st_size
+
+    for _, size, path in sorted(entries):
+        if total <= CACHE_MAX_BYTES:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+def _copy_atomic(src, dst):
+    """
+    Atomically put a copy of src at dst. Always a real copy: the library
+    files are rewritten in place by the app, so they must never share an
+    inode with a cache entry.
+    """
+    tmp = f'{dst}.{uuid.uuid4().hex}.tmp'
+    try:
+        shutil.copyfile(src, tmp)
+        os.replace(tmp, dst)
+    except OSError:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
 
 @app.route('/formats', methods=['GET'])
 def formats():
     """Get supported input and output formats"""
+    return jsonify(_FORMATS)
+
+def start_display():
+    """
+    Start one long-lived Xvfb server and export DISPLAY, so PDF conversions
+    don't each pay for launching their own X server through xvfb-run
+    """
+    global _xvfb_proc, _xvfb_owner
+
+    if os.environ.get('DISPLAY'):
+        return
+
+    _clear_stale_display()
+
+    # Xvfb writes the display number to this pipe once it accepts clients
+    read_fd, write_fd = os.pipe()
     try:
-        # Get input formats
-        result = subprocess.run(
-            ['ebook-convert', '--input-fmts'],
-            capture_output=True,
-            text=True
+        proc = subprocess.Popen(
+            ['Xvfb', XVFB_DISPLAY, '-screen', '0', '1024x768x24', '-nolisten', 'tcp',
+             '-displayfd', str(write_fd)],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            pass_fds=(write_fd,)
         )
-        input_formats = result.stdout.strip().split()
+    except FileNotFoundError:
+        print("Xvfb not found, PDF conversions will use xvfb-run")
+        return
+    finally:
+        os.close(write_fd)
 
-        # Get output formats
-        result = subprocess.run(
-            ['ebook-convert', '--output-fmts'],
-            capture_output=True,
-            text=True
-        )
-        output_formats = result.stdout.strip().split()
+    try:
+        ready, _, _ = select.select([read_fd], [], [], 10)
+        started = bool(ready) and bool(os.read(read_fd, 16).strip())
+    finally:
+        os.close(read_fd)
 
-        return jsonify({
-            'input_formats': input_formats,
-            'output_formats': output_formats
-        })
-    except Exception as e:
-        return jsonify({
-            'error': str(e)
-        }), 500
+    if not started:
+        print("Xvfb failed to start, PDF conversions will use xvfb-run")
+        proc.kill()
+        proc.wait()
+        return
+
+    _xvfb_proc = proc
+    _xvfb_owner = os.getpid()
+    os.environ['DISPLAY'] = XVFB_DISPLAY
+    print(f"Xvfb running on display {XVFB_DISPLAY}")
+
+def _clear_stale_display():
+    """Remove the lock and socket of a previous Xvfb, only if it is dead"""
+    try:
+        with open(XVFB_LOCK) as f:
+            pid = int(f.read().strip())
+    except (FileNotFoundError, ValueError):
+        return
+
+    try:
+        os.kill(pid, 0)
+        return  # A live X server owns the display
+    except ProcessLookupError:
+        pass
+    except PermissionError:
+        return  # Alive, owned by another user
+
+    for stale in (XVFB_SOCKET, XVFB_LOCK):
+        try:
+            os.remove(stale)
+        except FileNotFoundError:
+            pass
+
+def shared_display_ready():
+    """
+    Whether PDF conversions can use DISPLAY directly. False when the shared
+    Xvfb has died, so conversions fall back to their own xvfb-run.
+    """
+    if _xvfb_proc is None:
+        # No Xvfb of ours; a DISPLAY set outside the service is trusted
+        return 'DISPLAY' in os.environ
+
+    if os.getpid() == _xvfb_owner:
+        if _xvfb_proc.poll() is not None:
+            return False
+    else:
+        # Forked worker: Xvfb is the master's child, so probe it by pid
+        try:
+            os.kill(_xvfb_proc.pid, 0)
+        except ProcessLookupError:
+            return False
+    return os.path.exists(XVFB_SOCKET)
+
+# Calibre's version is fixed for an install, so only the first successful
+# call spawns ebook-convert; failures aren't cached and are retried
+@functools.lru_cache(maxsize=1)
+def _read_calibre_version():
+    result = _probe(['ebook-convert', '--version'], timeout=30)
+    # Extract version from output
+    version_line = result.stdout.split('\n')[0]
+    return version_line.strip()
 
 def get_calibre_version():
     """Get Calibre version"""
     try:
-        result = subprocess.run(
-            ['ebook-convert', '--version'],
-            capture_output=True,
-            text=True
-        )
-        # Extract version from output
-        version_line = result.stdout.split('\n')[0]
-        return version_line.strip()
+        return _read_calibre_version()
     except:
         return 'unknown'
 
@@ -192,7 +732,9 @@ if __name__ == '__main__':
     print("=" * 50)
     print(f"Calibre version: {get_calibre_version()}")
     print(f"Books path: {BOOKS_BASE}")
+    start_display()
     print(f"Listening on: http://0.0.0.0:8080")
     print("=" * 50)
 
-    app.run(host='0.0.0.0', port=8080, debug=True)
+    # Development server; production runs under gunicorn (see gunicorn_conf.py)
+    app.run(host='0.0.0.0', port=8080)
@@ -0,0 +1,54 @@
+"""
+Persistent Calibre conversion worker
+Runs inside Calibre's own interpreter: calibre-debug -e calibre_worker.py
+
+Reads one JSON job per line on stdin:
+    {"src": "/books/a.epub", "dst": "/books/a.mobi", "opts": ["--title", "A"]}
+and answers each with one JSON line on stdout:
+    {"ok": true} or {"ok": false, "error": "..."}
+Calibre's log goes to stderr, followed by JOB_END once the job is done.
+"""
+
+import json
+import os
+import sys
+import traceback
+
+# Must match WORKER_JOB_END in calibre-service.py
+JOB_END = '--- calibre_worker job end ---'
+
+def run_job(ebook_convert, job):
+    """Convert one job and build its reply"""
+    try:
+        try:
+            code = ebook_convert(['ebook-convert', job['src'], job['dst'], *job['opts']])
+        except SystemExit as e:
+            # The option parser exits on bad arguments
+            code = e.code
+    except Exception:
+        return {'ok': False, 'error': traceback.format_exc()}
+
+    if code in (0, None):
+        return {'ok': True}
+    return {'ok': False, 'error': f'ebook-convert exited with code {code}'}
+
+def main():
+    # Keep the real stdout for replies and send everything Calibre prints
+    # (progress, warnings) to stderr so it can't corrupt the protocol
+    replies = os.fdopen(os.dup(sys.stdout.fileno()), 'w', buffering=1)
+    sys.stdout.flush()
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+
+    # Imported once; this is the startup cost the worker exists to amortize
+    from calibre.ebooks.conversion.cli import main as ebook_convert
+
+    for line in sys.stdin:
+        reply = run_job(ebook_convert, json.loads(line))
+        sys.stdout.flush()
+        # Leading newline: Calibre's last output may not end with one
+        sys.stderr.write('\n' + JOB_END + '\n')
+        sys.stderr.flush()
+        replies.write(json.dumps(reply) + '\n')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,31 @@
+"""
+Gunicorn settings for the Calibre HTTP API service
+Run: gunicorn -c gunicorn_conf.py calibre-service:app
+"""
+
+import importlib
+import multiprocessing
+import os
+
+bind = '0.0.0.0:8080'
+
+# Conversion jobs and their status live in process memory, so every request
+# has to reach the same worker. Conversions still use all cores: that worker's
+# pool runs one ebook-convert per CPU (CALIBRE_CONVERT_WORKERS).
+workers = 1
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', multiprocessing.cpu_count() * 4))
+
+# Requests only queue or poll jobs, so they should never take long
+timeout = 60
+
+# Import the app (and probe Calibre's formats) once in the master, so a
+# restarted worker doesn't pay for it again
+preload_app = True
+
+def on_starting(server):
+    """Start shared resources in the master; forked workers inherit them"""
+    service = importlib.import_module('calibre-service')
+    service.start_display()
+    server.log.info("Calibre version: %s", service.get_calibre_version())
+    server.log.info("Books path: %s", service.BOOKS_BASE)
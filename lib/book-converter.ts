@@ -10,6 +10,10 @@ import { getBooksPath } from './paths';
 const CALIBRE_MODE = process.env.CALIBRE_MODE || 'local';
 const CALIBRE_API_URL = process.env.CALIBRE_API_URL || 'http://localhost:8080';
 
+// Remote conversions are queued by the service and polled until done
+const REMOTE_POLL_INTERVAL = 1000; // 1 second
+const REMOTE_CONVERSION_TIMEOUT = 10 * 60 * 1000; // 10 minutes
+
 // Import calibre-node (for local mode)
 // Note: calibre-node requires Calibre to be installed on the system
 let calibre: any;
@@ -276,7 +280,7 @@ export class BookConverter {
           source_path: remoteSourcePath,
           target_path: remoteTargetPath,
         }),
-        signal: AbortSignal.timeout(300000), // 5 minute timeout
+        signal: AbortSignal.timeout(30000), // 30 second timeout to queue the job
       });
 
       if (!response.ok) {
@@ -284,8 +288,57 @@ export class BookConverter {
         throw new Error(error.error || 'Remote conversion failed');
       }
 
-      const result = await response.json();
-      console.log('Remote conversion result:', result);
+      // The service queues the conversion and returns a job id to poll
+      const { job_id: remoteJobId } = await response.json();
+      const deadline = Date.now() + REMOTE_CONVERSION_TIMEOUT;
+
+      while (Date.now() < deadline) {
+        await new Promise((resolve) => setTimeout(resolve, REMOTE_POLL_INTERVAL));
+
+        // Poll failures (timeouts, proxy error pages) are transient: the job
+        // keeps running on the service, so retry until the deadline
+        let statusResponse: Response;
+        try {
+          statusResponse = await fetch(
+            `${CALIBRE_API_URL}/convert/status/${remoteJobId}`,
+            {
+              method: 'GET',
+              signal: AbortSignal.timeout(5000), // 5 second timeout
+            }
+          );
+        } catch (error) {
+          console.warn('Failed to fetch remote job status, retrying:', error);
+          continue;
+        }
+
+        if (statusResponse.status === 404) {
+          throw new Error('Remote conversion job not found');
+        }
+
+        if (!statusResponse.ok) {
+          console.warn(`Remote job status returned ${statusResponse.status}, retrying`);
+          continue;
+        }
+
+        let result;
+        try {
+          result = await statusResponse.json();
+        } catch (error) {
+          console.warn('Invalid remote job status response, retrying:', error);
+          continue;
+        }
+
+        if (result.status === 'completed') {
+          console.log('Remote conversion result:', result);
+          return;
+        }
+
+        if (result.status === 'failed') {
+          throw new Error(result.error || 'Remote conversion failed');
+        }
+      }
+
+      throw new Error('Conversion timed out');
     } catch (error) {
       if (error instanceof Error) {
         throw new Error(`Remote conversion failed: ${error.message}`);